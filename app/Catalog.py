@@ -0,0 +1,171 @@
+"""
+Catalog of remote weather data snapshots. The catalog is a local SQLite table that
+remembers every zip file seen in the remote listing together with its date, size,
+ETag and whether it was already downloaded and ingested.
+"""
+
+import codecs
+from datetime import datetime
+from html.parser import HTMLParser
+from pathlib import Path
+import re
+import sqlite3
+
+import app.Helper
+
+
+SNAPSHOT_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2})_wetterdaten_CSV\.zip$")
+# Size column of a directory listing, e.g. '835K' or '1.2M'.
+SIZE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)([KMG]?)$")
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+class LinkExtractor(HTMLParser):
+    """
+    Collect links to snapshots from a HTML listing that is fed in chunks.
+    If the listing is ordered from newest to oldest snapshot, extraction stops at
+    the first link that is already known. The order is taken from the dates of
+    the first two snapshots, so a listing in any other order is read completely.
+    The size of a snapshot is taken from the table row of its link, if the listing shows one.
+    """
+
+    def __init__(self, known_filenames=()):
+        super().__init__()
+        self.known_filenames = set(known_filenames)
+        self.links = []  # list of (filename, href, size) of new snapshots in order of the listing
+        self.reached_known = False
+        self.awaiting_size = False  # within the table row of the last new link
+        self.last_date = None  # date of the previous snapshot in the listing
+        self.descending = None  # order of the listing, unknown until the second snapshot
+        self.known_pending = False  # a known snapshot came first, stop if the listing turns out descending
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self.awaiting_size = False
+        if tag != "a" or self.reached_known:
+            return
+
+        href = dict(attrs).get("href") or ""
+        filename = href.replace("\\", "/").rsplit("/", 1)[-1]
+        if not SNAPSHOT_PATTERN.search(filename):
+            return
+
+        date = SNAPSHOT_PATTERN.search(filename).group(1)
+        if self.last_date is not None and date != self.last_date:
+            if self.descending is None:
+                self.descending = date < self.last_date
+            elif self.descending and date > self.last_date:
+                self.descending = False  # not sorted, so known snapshots may be followed by new ones
+        self.last_date = date
+        if self.known_pending and self.descending:
+            self.reached_known = True
+            return
+
+        if filename in self.known_filenames:
+            if self.descending:
+                self.reached_known = True
+            elif self.descending is None:
+                self.known_pending = True
+        elif filename not in (link[0] for link in self.links):
+            self.links.append((filename, href, None))
+            self.awaiting_size = True
+
+    def handle_data(self, data):
+        if not self.awaiting_size:
+            return
+
+        match = SIZE_PATTERN.match(data.strip())
+        if match:
+            filename, href, _ = self.links[-1]
+            size = int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+            self.links[-1] = (filename, href, size)
+            self.awaiting_size = False
+
+    def handle_endtag(self, tag):
+        if tag == "tr":
+            self.awaiting_size = False
+
+
+class SnapshotCatalog(object):
+    """
+    Persistent catalog of remote snapshots, stored in a SQLite file in the data directory.
+    The status of a snapshot is one of 'listed', 'downloaded' or 'ingested'.
+    """
+
+    def __init__(self, path=None):
+
+        self.logger = app.Helper.MyLogger()
+        self.logger.setup_handlers()
+
+        if path is None:
+            data_dir = app.Helper.get_setting(["general", "data_dir"])
+            path = Path.cwd().joinpath(data_dir).joinpath(app.Helper.get_setting(["general", "catalog"]))
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(str(self.path))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "filename TEXT PRIMARY KEY, "
+            "href TEXT NOT NULL, "
+            "snapshot_date TEXT NOT NULL, "
+            "size INTEGER, "
+            "etag TEXT, "
+            "status TEXT NOT NULL DEFAULT 'listed', "
+            "updated_at TEXT NOT NULL)")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def known_filenames(self):
+        return [row[0] for row in self.connection.execute("SELECT filename FROM snapshots")]
+
+    def refresh(self, chunks, encoding="utf-8"):
+        """
+        Add new snapshots from a HTML listing that is given as iterable of byte chunks,
+        e.g. 'requests.Response.iter_content()'. Reading stops at the first known snapshot
+        of a listing ordered from newest to oldest snapshot.
+
+        :return: Number of new snapshots.
+        """
+
+        extractor = LinkExtractor(self.known_filenames())
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        for chunk in chunks:
+            extractor.feed(decoder.decode(chunk))
+            if extractor.reached_known:
+                break
+        else:
+            extractor.feed(decoder.decode(b"", final=True))
+            extractor.close()
+
+        now = datetime.now().isoformat(timespec="seconds")
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO snapshots (filename, href, snapshot_date, size, updated_at) VALUES (?, ?, ?, ?, ?)",
+            [(filename, href, SNAPSHOT_PATTERN.search(filename).group(1), size, now)
+             for filename, href, size in extractor.links])
+        self.connection.commit()
+
+        self.logger.debug(f"Found {len(extractor.links)} new snapshots in remote listing")
+        return len(extractor.links)
+
+    def get_newest(self):
+        """:return: Row of newest snapshot as dict, or None if catalog is empty."""
+
+        self.connection.row_factory = sqlite3.Row
+        try:
+            row = self.connection.execute(
+                "SELECT * FROM snapshots ORDER BY snapshot_date DESC, filename DESC LIMIT 1").fetchone()
+        finally:
+            self.connection.row_factory = None
+        return dict(row) if row is not None else None
+
+    def mark(self, filename, status, size=None, etag=None):
+        """Set status of a snapshot, and optionally its size and ETag."""
+
+        self.connection.execute(
+            "UPDATE snapshots SET status = ?, size = COALESCE(?, size), etag = COALESCE(?, etag), updated_at = ? "
+            "WHERE filename = ?",
+            (status, size, etag, datetime.now().isoformat(timespec="seconds"), filename))
+        self.connection.commit()
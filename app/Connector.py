@@ -0,0 +1,282 @@
+from contextlib import contextmanager
+from datetime import datetime
+import pathlib
+import zlib
+
+from sqlalchemy import create_engine, Column, DateTime, BigInteger, Float, Integer, MetaData, Table, String, Text
+from sqlalchemy import and_, func, select
+from sqlalchemy.sql import text
+
+from app.Helper import get_setting, get_project_path, MyLogger
+
+
+# Key of the advisory lock that serialises runs of the DataManager.
+RUN_LOCK_NAME = "WeatherDataManager.ingest"
+
+
+class MyConnector(object):
+
+    def __init__(self, db_system_name: str = None):
+
+        self.logger = None
+        self.logger = MyLogger()
+        self.logger.setup_handlers(["EMAIL", "FILE", "CONSOLE"])
+
+        if db_system_name is None:
+            db_system_name = get_setting(["general", "db_system_name"])
+        self.db_system_name = db_system_name
+        self.connection = None
+        self.engine = None
+        self.stations = None
+        self.measures = None
+        self.metadata = None
+
+        try:
+            connect_info = get_setting([db_system_name, "drivername"])
+            assert bool(connect_info), f"Error reading settings."
+            self.logger.debug(f"Imported settings for {connect_info} from configfile")
+
+            is_connected = self.connect_database(db_system_name)
+            assert bool(is_connected), f"Error connecting to database and creating tables."
+            tables = self.test_query()
+            self.logger.debug(f"Successfully connected to database. Database contains tables: {tables}")
+        except AssertionError as ae:
+            self.logger.exception(f"Error connecting to database since assertion {ae}")
+        except Exception as ex:
+            self.logger.exception(f"Error connecting to database. Error: {ex}")
+
+    def connect_database(self, db_system_name: str = "postgresql"):
+        """Connect to database."""
+
+        assert (db_system_name in ["postgresql", "mysql", "sqlite"]), "Name of dbms is unknown"
+
+        if db_system_name == "sqlite":
+            # embedded database, a file in the project directory
+            DATABASE_URI = get_setting([db_system_name, "drivername"]) + ":///"\
+                             + str(pathlib.Path(get_project_path()).joinpath(get_setting([db_system_name, "database"])))
+            engine_options = {}
+            self.logger.debug(f"Connecting to: {DATABASE_URI}")
+        else:
+            DATABASE_URI = get_setting([db_system_name, "drivername"]) + "://"\
+                             + get_setting([db_system_name, "user"]) + ":"\
+                             + get_setting([db_system_name, "passwd"]) + "@"\
+                             + get_setting([db_system_name, "host"]) + ":"\
+                             + get_setting([db_system_name, "port"]) + "/"\
+                             + get_setting([db_system_name, "database_name"])
+            # one pooled connection per shard of the parallel load, and one for this connector
+            engine_options = {"pool_size": max(int(get_setting(["general", "load_shards"])) + 1, 5)}
+            self.logger.debug(f"Connecting to: {get_setting([db_system_name, 'host'])}")
+
+        try:
+            self.engine = create_engine(DATABASE_URI, echo=False, **engine_options)
+            self.connection = self.engine.connect()
+            self.metadata = MetaData(self.engine)
+            self.create_all_tables()
+        except Exception as ex:
+            self.logger.warning(f"Error connecting to Database. {ex}")
+
+        return self.required_tables_exist()
+
+    def create_all_tables(self):
+        assert bool(self.metadata), f"Metadata for schemas does not exist."
+
+        self.create_table_stations()
+        self.create_table_measures("measures")
+        self.create_table_quarantine()
+        self.create_table_ledger()
+
+    def required_tables_exist(self):
+        return {"stations", "measures"}.issubset(set(self.metadata.tables))
+
+    def test_query(self):
+        #self.create_table_measures('temporal_measures')
+        #self.create_table_measures('measures')
+        #self.create_table_stations('stations')
+        #self.metadata.create_all(self.engine)
+        return self.engine.table_names()
+
+    def create_table_stations(self, table_name="stations"):
+        """Create schema for table of weather data stations."""
+
+        self.stations = Table(
+            table_name, self.metadata,
+            Column('S_ID', Integer()),
+            Column('Standort', String(255), nullable=False),
+            Column('Geo_Breite', Float(), nullable=False),
+            Column('Geo_Laenge', Float(), nullable=False),
+            Column('Hoehe', Integer(), nullable=False),
+            Column('Betreiber', String(255), nullable=False),
+            Column('PLZ_matched', String(5), nullable=False),
+            Column('Ort_matched', String(255), nullable=False),
+            Column('Latitude_matched', Float(), nullable=False),
+            Column('Longitude_matched', Float(), nullable=False),
+            extend_existing=True
+        )
+        try:
+            self.stations.create(self.connection, checkfirst=True)  # If NOT exists, create the table.
+            self.logger.debug(f"Created table 'stations'")
+        except Exception:
+            self.logger.exception("Error creating Table in Database")
+
+    def create_table_measures(self, table_name="temporal_measures", CHECKFIRST=True, UNLOGGED=False):
+        """Create schema for temporary table of weather data measures that extend existing data measures.
+        An unlogged table skips the write-ahead log of PostgreSQL, other databases ignore 'UNLOGGED'."""
+
+        if table_name is None:
+            table_name = input("Name of new table for weather data measures, e.g. 'temp'? ")
+
+        table_measures = Table(
+            table_name,
+            self.metadata,
+            Column('Stations_ID', Integer(), nullable=False, primary_key=True),
+            Column('Datum', DateTime(), nullable=False, primary_key=True),
+            Column('Qualitaet', Integer(), nullable=True),
+            Column('Min_5cm', Float(), nullable=True),
+            Column('Min_2m', Float(), nullable=True),
+            Column('Mittel_2m', Float(), nullable=True),
+            Column('Max_2m', Float(), nullable=True),
+            Column('Relative_Feuchte', Float(), nullable=True),
+            Column('Mittel_Windstaerke', Float(), nullable=True),
+            Column('Max_Windgeschwindigkeit', Float(), nullable=True),
+            Column('Sonnenscheindauer', Float(), nullable=True),
+            Column('Mittel_Bedeckungsgrad', Float(), nullable=True),
+            Column('Niederschlagshoehe', Float(), nullable=True),
+            Column('Mittel_Luftdruck', Float(), nullable=True),
+            extend_existing=False,
+            prefixes=["UNLOGGED"] if UNLOGGED and self.engine.dialect.name == "postgresql" else []
+        )
+        try:
+            self.logger.debug(f"Checkfirst is '{CHECKFIRST}' for creating tables {table_name} ")
+            table_measures.create(self.connection, checkfirst=CHECKFIRST)  # If NOT exists, create the table.
+            if table_name == "measures":
+                self.measures = table_measures
+            self.logger.debug(f"Created table '{table_name}'")
+        except Exception:
+            self.logger.exception(f"Error creating Table {table_name} in Database")
+
+    def create_table_quarantine(self, table_name="quarantine_measures"):
+        """Create schema for table of rejected weather data measures. Raw values are kept as text of any length."""
+
+        measure_columns = ['Stations_ID', 'Datum', 'Qualitaet', 'Min_5cm', 'Min_2m', 'Mittel_2m', 'Max_2m',
+                           'Relative_Feuchte', 'Mittel_Windstaerke', 'Max_Windgeschwindigkeit',
+                           'Sonnenscheindauer', 'Mittel_Bedeckungsgrad', 'Niederschlagshoehe', 'Mittel_Luftdruck']
+
+        table_quarantine = Table(
+            table_name,
+            self.metadata,
+            *[Column(name, Text(), nullable=True) for name in measure_columns],
+            Column('Reason', Text(), nullable=False),
+            Column('Archive', String(255), nullable=True),
+            Column('Quarantined_At', DateTime(), nullable=False),
+            extend_existing=True
+        )
+        try:
+            table_quarantine.create(self.connection, checkfirst=True)  # If NOT exists, create the table.
+            self.logger.debug(f"Created table '{table_name}'")
+        except Exception:
+            self.logger.exception(f"Error creating Table {table_name} in Database")
+
+    def create_table_ledger(self, table_name="ingest_ledger"):
+        """Create schema for table of ingested archives, keyed by name and content hash of the archive."""
+
+        table_ledger = Table(
+            table_name,
+            self.metadata,
+            Column('Archive', String(255), nullable=False, primary_key=True),
+            Column('Content_Hash', String(64), nullable=False, primary_key=True),
+            Column('Rows', Integer(), nullable=True),
+            Column('Ingested_At', DateTime(), nullable=False),
+            extend_existing=True
+        )
+        try:
+            table_ledger.create(self.connection, checkfirst=True)  # If NOT exists, create the table.
+            self.logger.debug(f"Created table '{table_name}'")
+        except Exception:
+            self.logger.exception(f"Error creating Table {table_name} in Database")
+
+    def is_ingested(self, archive, content_hash):
+        """Check the ingest ledger for an archive with identical name and content."""
+
+        ledger = self.metadata.tables["ingest_ledger"]
+        statement = select([func.count()]).select_from(ledger).where(
+            and_(ledger.c.Archive == archive, ledger.c.Content_Hash == content_hash))
+        return self.connection.execute(statement).scalar() > 0
+
+    def record_ingestion(self, archive, content_hash, rows=None):
+        """Add an ingested archive to the ingest ledger."""
+
+        ledger = self.metadata.tables["ingest_ledger"]
+        self.connection.execute(ledger.insert().values(
+            Archive=archive, Content_Hash=content_hash, Rows=rows, Ingested_At=datetime.now()))
+        self.logger.debug(f"Recorded ingestion of '{archive}' in ledger")
+
+    @contextmanager
+    def run_lock(self):
+        """
+        Serialise runs, that write into the database. PostgreSQL and MySQL use an advisory lock
+        of the database session, other (embedded) databases use a lock file in the project directory.
+        """
+
+        dialect = self.engine.dialect.name
+        self.logger.debug(f"Waiting for run lock '{RUN_LOCK_NAME}'")
+        if dialect == "postgresql":
+            key = zlib.crc32(RUN_LOCK_NAME.encode())
+            self.connection.execute(text("SELECT pg_advisory_lock(:key)"), key=key)
+            try:
+                yield
+            finally:
+                self.connection.execute(text("SELECT pg_advisory_unlock(:key)"), key=key)
+        elif dialect == "mysql":
+            self.connection.execute(text("SELECT GET_LOCK(:name, -1)"), name=RUN_LOCK_NAME)
+            try:
+                yield
+            finally:
+                self.connection.execute(text("SELECT RELEASE_LOCK(:name)"), name=RUN_LOCK_NAME)
+        else:
+            import fcntl
+
+            lock_path = pathlib.Path(get_project_path()).joinpath(f".{RUN_LOCK_NAME}.lock")
+            with open(lock_path, "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def create_staging_tables(self, shards, table_name="temporal_measures"):
+        """Create one unlogged staging table per shard of a parallel load into the given temporary table.
+
+        :return: List of table names.
+        """
+
+        table_names = [f"{table_name}_shard_{shard}" for shard in range(shards)]
+        for table_name in table_names:
+            if table_name not in self.metadata.tables:
+                self.create_table_measures(table_name, CHECKFIRST=True, UNLOGGED=True)
+        return table_names
+
+    def drop_tables(self, table_names):
+        """Drop tables from database, e.g. the temporary tables of a finished run, if they exist."""
+
+        for table_name in table_names:
+            table = self.metadata.tables.get(table_name)
+            if table is None:
+                continue
+            try:
+                table.drop(self.connection, checkfirst=True)
+                self.metadata.remove(table)
+                self.logger.debug(f"Dropped table '{table_name}'")
+            except Exception:
+                self.logger.exception(f"Error dropping Table {table_name} in Database")
+
+    def get_table_statistics(self):
+        """Count rows of all known tables. Tables containing weather data measures also report their last date."""
+
+        statistics = {}
+        for table_name, table in self.metadata.tables.items():
+            statistics[table_name] = {
+                "rows": self.connection.execute(select([func.count()]).select_from(table)).scalar()}
+            if "Datum" in table.columns:
+                statistics[table_name]["last_date"] = self.connection.execute(
+                    select([func.max(table.columns["Datum"])])).scalar()
+        return statistics
@@ -0,0 +1,239 @@
+"""
+DataExporter streams the table 'measures' joined with 'stations' out of the database
+and writes it partitioned by month or by zip code prefix as Parquet or gzip CSV files.
+"""
+
+from datetime import datetime
+import gzip
+from itertools import groupby
+import json
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import and_, func, or_, select
+
+import app.Helper
+
+
+class DataExporter(object):
+    """
+    Export weather measures with bounded memory. The join is read once, ordered by partition,
+    through a server-side cursor in batches, and only one partition is written at a time. An incremental
+    export only rewrites partitions whose row count or last date changed since the
+    last export into the same directory.
+    """
+
+    STATE_FILE_NAME = "_export_state.json"  # leading underscore: ignored by Parquet readers
+
+    def __init__(self, export_dir, file_format="parquet", partition_by="month", batch_size=10000, database=None):
+
+        assert file_format in ["parquet", "csv"], "Format of export is unknown"
+        assert partition_by in ["month", "zipcode"], "Partitioning of export is unknown"
+
+        self.logger = app.Helper.MyLogger()
+        self.logger.setup_handlers()
+        self.database = database if database is not None else app.Helper.MyConnector()
+
+        self.export_dir = Path(export_dir)
+        self.file_format = file_format
+        self.partition_by = partition_by
+        self.batch_size = batch_size
+        return
+
+    def run(self, incremental=False):
+        """Export all partitions, or only the partitions changed since the last export."""
+        try:
+            self.logger.info(f"DataExporter running...")
+            self.export_dir.mkdir(parents=True, exist_ok=True)
+
+            state = self.read_state() if incremental else {}
+            fingerprints = self.get_partition_fingerprints()
+            changed = [key for key, fingerprint in fingerprints.items() if state.get(key) != fingerprint]
+            self.logger.info(f"Exporting {len(changed)} of {len(fingerprints)} partitions to '{self.export_dir}'")
+
+            if changed:
+                self.export_partitions(changed, len(changed) < len(fingerprints), fingerprints, state)
+
+            self.logger.info("DataExporter closed.")
+        except Exception as ex:
+            self.logger.exception(f"Error while running DataExporter ({ex})")
+
+    def get_partition_columns(self):
+        """:return: SQL expressions, that determine the partition of a row."""
+
+        measures = self.database.metadata.tables["measures"]
+        stations = self.database.metadata.tables["stations"]
+        if self.partition_by == "month":
+            return [func.extract("year", measures.c.Datum), func.extract("month", measures.c.Datum)]
+        else:
+            return [func.substr(stations.c.PLZ_matched, 1, 2)]
+
+    def get_joined_tables(self):
+        measures = self.database.metadata.tables["measures"]
+        stations = self.database.metadata.tables["stations"]
+        return measures.outerjoin(stations, measures.c.Stations_ID == stations.c.S_ID)
+
+    def get_partition_key(self, values):
+        """Key of a partition that is also its relative directory, e.g. 'year=2020/month=01' or 'zip_prefix=95'."""
+
+        if self.partition_by == "month":
+            return f"year={int(values[0]):04d}/month={int(values[1]):02d}"
+        else:
+            return f"zip_prefix={values[0] if values[0] is not None else 'unknown'}"
+
+    def get_partition_fingerprints(self):
+        """Count rows and find last date per partition within the database.
+
+        :return: dict of partition key and [number of rows, last date]
+        """
+
+        measures = self.database.metadata.tables["measures"]
+        partition_columns = self.get_partition_columns()
+        statement = select(partition_columns + [func.count(), func.max(measures.c.Datum)]) \
+            .select_from(self.get_joined_tables()).group_by(*partition_columns)
+
+        fingerprints = {}
+        for row in self.database.connection.execute(statement):
+            last_date = row[-1].isoformat() if row[-1] is not None else None
+            fingerprints[self.get_partition_key(row[:-2])] = [row[-2], last_date]
+        return fingerprints
+
+    def get_partition_filter(self, key):
+        measures = self.database.metadata.tables["measures"]
+        stations = self.database.metadata.tables["stations"]
+        values = dict(part.split("=") for part in key.split("/"))
+
+        if self.partition_by == "month":
+            start = datetime(int(values["year"]), int(values["month"]), 1)
+            end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+            return and_(measures.c.Datum >= start, measures.c.Datum < end)
+        elif values["zip_prefix"] == "unknown":
+            return stations.c.PLZ_matched.is_(None)
+        else:
+            return func.substr(stations.c.PLZ_matched, 1, 2) == values["zip_prefix"]
+
+    def export_partitions(self, keys, filtered, fingerprints, state):
+        """Stream the joined rows once, ordered by partition, and switch to the next file when the partition changes.
+
+        :param keys: partition keys to export
+        :param filtered: restrict the query to the given partitions, otherwise all rows are exported
+        :param fingerprints: fingerprint per partition, stored in the state after its file is complete
+        :param state: state of the export, written after each partition
+        """
+
+        measures = self.database.metadata.tables["measures"]
+        stations = self.database.metadata.tables["stations"]
+        columns = list(measures.columns) + [column for column in stations.columns if column.name != "S_ID"]
+        column_names = [column.name for column in columns]
+        partition_columns = self.get_partition_columns()
+        statement = select(columns + [column.label(f"partition_{index}")
+                                      for index, column in enumerate(partition_columns)]) \
+            .select_from(self.get_joined_tables()) \
+            .order_by(*partition_columns, measures.c.Datum, measures.c.Stations_ID)
+        if filtered:
+            statement = statement.where(or_(*[self.get_partition_filter(key) for key in keys]))
+
+        partition = None
+        try:
+            # 'stream_results' uses a server-side cursor, so only one batch is held in memory
+            with self.database.engine.connect().execution_options(stream_results=True) as connection:
+                result = connection.execute(statement)
+                while True:
+                    batch = result.fetchmany(self.batch_size)
+                    if not batch:
+                        break
+                    for key, rows in groupby(batch, lambda row: self.get_partition_key(row[len(columns):])):
+                        if partition is None or partition.key != key:
+                            if partition is not None:
+                                self.finish_partition(partition, fingerprints, state)
+                            partition = self.open_partition(key, columns)
+                        data = pd.DataFrame.from_records([row[:len(columns)] for row in rows], columns=column_names)
+                        partition.writer.write(data)
+                        partition.rows += len(data)
+            if partition is not None:
+                self.finish_partition(partition, fingerprints, state)
+                partition = None
+        finally:
+            if partition is not None:  # an incomplete file never replaces the last export
+                partition.writer.close()
+                partition.temporary_path.unlink()
+
+    def open_partition(self, key, columns):
+        file_path = self.export_dir.joinpath(key).joinpath("part.parquet" if self.file_format == "parquet"
+                                                           else "part.csv.gz")
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = file_path.with_name(file_path.name + ".tmp")
+        return Partition(key, file_path, temporary_path, self.get_writer(temporary_path, columns))
+
+    def finish_partition(self, partition, fingerprints, state):
+        """Replace the file of a completely written partition and record it as exported."""
+
+        partition.writer.close()
+        partition.temporary_path.replace(partition.file_path)
+        state[partition.key] = fingerprints[partition.key]
+        self.write_state(state)  # an interrupted export resumes after the last written partition
+        self.logger.debug(f"Exported {partition.rows} rows of partition '{partition.key}'")
+
+    def get_writer(self, path, columns):
+        if self.file_format == "parquet":
+            return ParquetWriter(path, columns)
+        else:
+            return CsvWriter(path)
+
+    def read_state(self):
+        state_path = self.export_dir.joinpath(self.STATE_FILE_NAME)
+        return json.loads(state_path.read_text()) if state_path.is_file() else {}
+
+    def write_state(self, state):
+        self.export_dir.joinpath(self.STATE_FILE_NAME).write_text(json.dumps(state, indent=2, sort_keys=True))
+
+
+class Partition(object):
+    """File of one partition while it is written."""
+
+    def __init__(self, key, file_path, temporary_path, writer):
+        self.key = key
+        self.file_path = file_path
+        self.temporary_path = temporary_path
+        self.writer = writer
+        self.rows = 0
+
+
+class CsvWriter(object):
+    """Append batches of rows to a gzip CSV file in the format of the source files."""
+
+    def __init__(self, path):
+        self.file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        self.header = True
+
+    def write(self, data):
+        data.to_csv(self.file, sep=";", decimal=",", index=False, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter(object):
+    """Append batches of rows as row groups to a Parquet file. Requires the optional package 'pyarrow'."""
+
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Exporting to Parquet requires 'pyarrow'. Install it or export to csv.")
+
+        # a fixed schema from the table definition, since a batch may contain only NULL in a column
+        types = {"integer": pyarrow.int64(), "big_integer": pyarrow.int64(), "float": pyarrow.float64(),
+                 "datetime": pyarrow.timestamp("us"), "string": pyarrow.string()}
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([(column.name, types[column.type.__visit_name__])
+                                      for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(str(path), self.schema)
+
+    def write(self, data):
+        self.writer.write_table(self.pyarrow.Table.from_pandas(data, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        self.writer.close()
@@ -5,21 +5,47 @@ zip code next to each weather data station. The WDM enriches weather data with i
 from weather data station, and appends the newest data to an existing SQL table.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import hashlib
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from sqlalchemy import bindparam
+from sqlalchemy import DateTime
 from sqlalchemy import delete
 from sqlalchemy import insert
 from sqlalchemy import func
 from sqlalchemy import select
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import text
+import time
+import uuid
 import zipfile
 
+import app.Catalog
+import app.Geodata
 import app.Helper
 
 
+# Physically plausible ranges (inclusive) of weather measures at a German weather data station.
+MEASURE_RANGES = {
+    "Min_5cm": (-60.0, 60.0),  # °C
+    "Min_2m": (-60.0, 60.0),  # °C
+    "Mittel_2m": (-60.0, 60.0),  # °C
+    "Max_2m": (-60.0, 60.0),  # °C
+    "Relative_Feuchte": (0.0, 100.0),  # %
+    "Mittel_Windstaerke": (0.0, 75.0),  # m/s
+    "Max_Windgeschwindigkeit": (0.0, 100.0),  # m/s
+    "Sonnenscheindauer": (0.0, 24.0),  # h
+    "Mittel_Bedeckungsgrad": (0.0, 8.0),  # eighths
+    "Niederschlagshoehe": (0.0, 500.0),  # mm
+    "Mittel_Luftdruck": (500.0, 1100.0),  # hPa
+}
+
+# Quality levels used by the DWD for daily measures.
+QUALITY_CODES = [1, 2, 3, 5, 7, 8, 9, 10]
+
+
 class DataManager(object):
     """
     DataManager imports data of weather stations and weather measures,
@@ -27,14 +53,15 @@ class DataManager(object):
     and imports new weather measure to SQL table.
     """
 
-    def __init__(self):
+    def __init__(self, connect_database=True):
 
         #self.config = configparser.ConfigParser()
         #self.config.read(pathlib.Path.cwd().joinpath("config").joinpath("config.ini"))
 
         self.logger = app.Helper.MyLogger()
         self.logger.setup_handlers()
-        self.database = app.Helper.MyConnector()
+        self.database = app.Helper.MyConnector() if connect_database else None
+        self.catalog = app.Catalog.SnapshotCatalog() if connect_database else None
 
         self.lat_values = None
         self.long_values = None
@@ -42,30 +69,81 @@ class DataManager(object):
         self.saved_zipfile_path = None
         self.data_stations = None
         self.data_weather = None
+        self.data_quarantine = None
+        self.stage_timings = {}
+        self.zipfile_hash = None
+        self.temporal_table_name = "temporal_measures"
+        self.staging_table_names = []
         return
 
-    def run(self):
+    def run(self, zipfile_path=None):
+        """Import the given zip file, or the last saved zip file, into database."""
         try:
             self.logger.info(f"DataManager running...")
-            self.find_last_zipfile()
+            if zipfile_path is None:
+                self.run_stage(self.find_last_zipfile)
+            else:
+                self.saved_zipfile_path = Path(zipfile_path)
 
-            self.import_weather_stations()
-            self.import_weather_measures()
-            self.import_locational_data()
+            with self.database.run_lock():
+                self.zipfile_hash = self.run_stage(self.get_zipfile_hash)
+                if self.database.is_ingested(Path(self.saved_zipfile_path).name, self.zipfile_hash):
+                    self.logger.info(f"Skipped '{self.saved_zipfile_path}', since it is already ingested.")
+                    return
 
-            self.enrich_data_stations()
-            self.get_nearest_zipcode()
+                self.prepare_data(self.saved_zipfile_path)
 
-            self.database.clear_temporal_table()
-            self.sql_from_weather_measures()
-            self.delete_old_weather_data()
-            self.insert_new_weather_data()  # show changes in last date of weather date
+                self.start_staging()
+                try:
+                    self.run_stage(self.sql_from_weather_measures)
+                    self.run_stage(self.insert_new_weather_data)  # show changes in last date of weather date
+                finally:
+                    self.drop_staging_tables()
 
+            self.logger.info(f"Stage timings: {self.format_stage_timings()}")
             self.logger.info("DataManager closed.")
             print(f"\n========================= GOOD BYE ==============================")
         except Exception:
             self.logger.exception(f"Error while running DataManager")
 
+    def prepare_data(self, zipfile_path=None):
+        """Import, enrich and validate data of the given or the last saved zip file without touching the database."""
+
+        if zipfile_path is None:
+            self.run_stage(self.find_last_zipfile)
+        else:
+            self.saved_zipfile_path = Path(zipfile_path)
+
+        self.run_stage(self.import_weather_stations)
+        self.run_stage(self.import_weather_measures)
+        self.run_stage(self.import_locational_data)
+
+        self.run_stage(self.enrich_data_stations)
+        self.run_stage(self.get_nearest_zipcode)
+
+        self.run_stage(self.validate_weather_measures)
+
+    def start_staging(self):
+        """Use staging tables of its own, so stages of different runs never interfere."""
+        self.temporal_table_name = f"temporal_measures_{uuid.uuid4().hex[:12]}"
+
+    def drop_staging_tables(self):
+        self.database.drop_tables(
+            [name for name in self.database.metadata.tables if name.startswith(self.temporal_table_name)])
+
+    def run_stage(self, stage):
+        """Run a single step of the pipeline and record its duration in 'stage_timings'."""
+
+        start = time.perf_counter()
+        try:
+            return stage()
+        finally:
+            self.stage_timings[stage.__name__] = time.perf_counter() - start
+            self.logger.debug(f"Stage '{stage.__name__}' took {self.stage_timings[stage.__name__]:.3f}s")
+
+    def format_stage_timings(self):
+        return ", ".join(f"{stage}={seconds:.3f}s" for stage, seconds in self.stage_timings.items())
+
     def find_last_zipfile(self):
         """
         Find last zip file containing weather resources that is available in subdirectory 'resources'.
@@ -92,6 +170,15 @@ class DataManager(object):
         except FileNotFoundError:
             self.logger.exception()
 
+    def get_zipfile_hash(self):
+        """SHA-256 of the content of the zip file, that identifies an archive in the ingest ledger."""
+
+        sha256 = hashlib.sha256()
+        with open(self.saved_zipfile_path, "rb") as zip_file:
+            for chunk in iter(lambda: zip_file.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
     def zipfile_exists(self):
         """
         Ensure a given zipfile name is a valid file,
@@ -172,43 +259,23 @@ class DataManager(object):
         data_dir = app.Helper.get_setting(["general", "data_dir"])
         file_name = data_dir + '/geodaten_de.csv'  # filename of static mapping resources,
         # that relates zip codes to coordinates in Germany
-        new_columns = ['Plz', 'Ort', 'Latitude', 'Longitude']
-
-        # parse zip code with a leading zero:
-        # def cast_to_str(x):
-        #    if len(x) > 4:
-        #        return str(x)
-        #    else:
-        #        return "0" + str(x)
 
-        # create DataFrame
+        # keep the memory-mapped arrays, that are rebuilt if the csv file changed. A DataFrame
+        # would copy them into memory, so only the row of a matched zip code is read.
         try:
             assert Path(file_name).exists(), f"Local geodata.csv file does not exists on path."
 
-            self.mapping_zipcode_coordinates = pd.read_csv(
-                file_name,
-                delimiter=";",  # ensure utf-encoding, ensure delimiter ";"
-                index_col=False,
-                header=0,
-                names=new_columns,
-                dtype={
-                    'Plz': np.str,
-                    'Ort': np.str,
-                    'Latitude': np.float,
-                    'Longitude': np.float},
-                encoding='cp1250'  # converts german encoding
-                # converters = {"Plz": cast_to_str}
-            )
-            self.logger.info("Imported into DataFrame")
+            self.mapping_zipcode_coordinates = app.Geodata.load_artifact(file_name)
+            self.logger.info("Imported memory-mapped arrays")
 
         except (ImportError, Exception) as ex:
-            self.logger.error(f"Error importing {file_name} to DataFrame 'mapping_zipcode_coordinates'. {ex}")
+            self.logger.error(f"Error importing {file_name} to arrays 'mapping_zipcode_coordinates'. {ex}")
 
     def enrich_data_stations(self):
         """Appends four columns to existing DataFrame 'data_stations'."""
 
         try:
-            appended_columns = self.mapping_zipcode_coordinates.columns + "_matched"
+            appended_columns = [name + "_matched" for name in app.Geodata.ARRAY_NAMES]
 
             self.data_stations.loc[:, str(appended_columns[0])] = np.nan
             self.data_stations.loc[:, str(appended_columns[1])] = np.nan
@@ -234,7 +301,9 @@ class DataManager(object):
         # find the minimal distance, and return the corresponding zip code
         # as the nearest zip code for the data station.
         distance = abs(long) + abs(lat)
-        nearest_location = self.mapping_zipcode_coordinates.iloc[np.argmin(distance)]
+        nearest_index = np.argmin(distance)
+        nearest_location = pd.Series({name: self.mapping_zipcode_coordinates[name][nearest_index].item()
+                                      for name in app.Geodata.ARRAY_NAMES})
 
         return nearest_location
 
@@ -243,22 +312,129 @@ class DataManager(object):
          that has the minimal distance to a data station."""
 
         try:
-            self.lat_values = self.mapping_zipcode_coordinates["Latitude"].values
-            self.long_values = self.mapping_zipcode_coordinates["Longitude"].values
+            self.lat_values = self.mapping_zipcode_coordinates["Latitude"]
+            self.long_values = self.mapping_zipcode_coordinates["Longitude"]
 
-            self.data_stations[["Plz_matched", "Ort_matched", "Longitude_matched", "Latitude_matched"]] \
+            self.data_stations[["Plz_matched", "Ort_matched", "Latitude_matched", "Longitude_matched"]] \
                 = self.data_stations.apply(self.find_nearest_zipcode, axis=1)
             self.logger.info("Mapped data_stations to zipcodes")
         except Exception:
             self.logger.exception("Can't map a data_station to a zipcode")
 
-    def sql_from_weather_measures(self):
+    def validate_weather_measures(self):
+        """
+        Check all weather measures at once before loading them into database.
+        Rows with a missing or duplicate key (Stations_ID, Datum), non-numeric values,
+        values outside of 'MEASURE_RANGES' or an unknown quality code are moved
+        to DataFrame 'data_quarantine' together with their reason codes.
+        """
+
         try:
-            table_name = "temporal_measures"
-            self.data_weather.to_sql(table_name, con=self.database.connection, if_exists='replace', index=False)
-            self.logger.info(f"Transferred DataFrame containing weather data to temporary table '{table_name}'")
+            data = self.data_weather
+            numeric_columns = ["Stations_ID", "Qualitaet"] + list(MEASURE_RANGES)
+            numeric = data[numeric_columns].apply(self.to_numeric)
+
+            # every column of 'failed' holds a boolean mask for one reason code
+            failed = pd.DataFrame(index=data.index)
+            failed["missing_key"] = numeric["Stations_ID"].isna() | data["Datum"].isna()
+            failed["non_numeric"] = (numeric.isna() & data[numeric_columns].notna()).any(axis=1)
+            failed["unknown_quality"] = numeric["Qualitaet"].notna() & ~numeric["Qualitaet"].isin(QUALITY_CODES)
+            for column, (lower, upper) in MEASURE_RANGES.items():
+                failed[f"range_{column}"] = (numeric[column] < lower) | (numeric[column] > upper)
+
+            # only the first of the otherwise valid rows with the same key is loaded,
+            # so an invalid row never displaces a valid row of its key
+            keys = pd.DataFrame({"Stations_ID": numeric["Stations_ID"], "Datum": data["Datum"]})[~failed.any(axis=1)]
+            failed.insert(1, "duplicate_key",
+                          keys.duplicated(keep="first").reindex(data.index, fill_value=False))
+
+            is_failed = failed.any(axis=1)
+            reasons = pd.Series("", index=data.index)
+            for code in failed.columns:
+                reasons = reasons.mask(failed[code], reasons + code + ";")
+
+            self.data_quarantine = data[is_failed].copy()
+            self.data_quarantine["Reason"] = reasons[is_failed].str.rstrip(";")
+            self.data_weather = data[~is_failed].copy()
+            self.data_weather[numeric_columns] = numeric[~is_failed]
+            self.data_weather["Stations_ID"] = self.data_weather["Stations_ID"].astype("int64")
+
+            if is_failed.any():
+                self.logger.warning(f"Quarantined {is_failed.sum()} of {len(data)} rows of weather data. "
+                                    f"Reasons: {failed.sum()[failed.sum() > 0].to_dict()}")
+            else:
+                self.logger.info(f"Validated {len(data)} rows of weather data")
+        except Exception:
+            self.logger.exception("Error validating weather data")
+
+    @staticmethod
+    def to_numeric(column):
+        """
+        Convert a column of weather measures to numbers, invalid values become NaN.
+        'read_csv' keeps a whole column as text, if a single value is not a number,
+        so the german decimal comma has to be replaced first.
+        """
+
+        if column.dtype == object:
+            column = column.astype(str).str.replace(",", ".", regex=False).where(column.notna())
+        return pd.to_numeric(column, errors="coerce")
+
+    def sql_from_quarantine(self, connection):
+        """Append rejected weather measures and their reason codes to table 'quarantine_measures'.
+        'insert_new_weather_data' calls it within its transaction, so rejected rows of an archive
+        are appended exactly once, together with its clean rows and its ledger entry."""
+
+        try:
+            if self.data_quarantine is None or self.data_quarantine.empty:
+                return
+            table_name = "quarantine_measures"
+            quarantine = self.data_quarantine.astype(str).astype(object).where(self.data_quarantine.notna(), None)
+            quarantine["Archive"] = Path(self.saved_zipfile_path).name
+            quarantine["Quarantined_At"] = datetime.now()
+            quarantine.to_sql(table_name, con=connection, if_exists='append', index=False)
+            self.logger.info(f"Transferred {len(quarantine)} rejected rows to table '{table_name}'")
+        except Exception:
+            self.logger.exception("Error transferring rejected weather data to Database")
+            raise
+
+    def sql_from_weather_measures(self, shards=None):
+        """
+        Transfer weather data to unlogged staging tables. Rows are partitioned by hash of 'Stations_ID'
+        into shards (setting 'load_shards'), and each shard is loaded in parallel over its own pooled
+        connection. 'insert_new_weather_data' merges all staging tables into table 'measures'.
+        """
+
+        if shards is None:
+            shards = int(app.Helper.get_setting(["general", "load_shards"]))
+        shards = max(shards, 1)
+        try:
+            self.staging_table_names = self.database.create_staging_tables(shards, self.temporal_table_name)
+            shard_of_rows = pd.util.hash_pandas_object(self.data_weather["Stations_ID"], index=False) % shards
+
+            with ThreadPoolExecutor(max_workers=shards) as executor:
+                loaded_rows = list(executor.map(
+                    self.sql_from_shard,
+                    self.staging_table_names,
+                    [self.data_weather[shard_of_rows == shard] for shard in range(shards)]))
+
+            staged_rows = sum(self.database.connection.execute(
+                select([func.count()]).select_from(self.database.metadata.tables[name])).scalar()
+                for name in self.staging_table_names)
+            if staged_rows != len(self.data_weather):
+                raise RuntimeError(f"Staging tables contain {staged_rows} of {len(self.data_weather)} rows")
+            self.logger.info(f"Transferred DataFrame containing weather data in shards of {loaded_rows} rows "
+                             f"to staging tables '{self.temporal_table_name}_shard_*'")
         except Exception:
             self.logger.exception("Error transferring DataFrame to Database")
+            raise
+
+    def sql_from_shard(self, table_name, data_shard):
+        """Replace the content of a staging table by a shard of weather data, using a separate connection."""
+
+        with self.database.engine.connect() as connection:
+            connection.execute(self.database.metadata.tables[table_name].delete())
+            data_shard.to_sql(table_name, con=connection, if_exists='append', index=False)
+        return len(data_shard)
 
     def sql_from_weather_stations(self):
         """
@@ -271,50 +447,39 @@ class DataManager(object):
         except Exception:
             self.logger.exception("Error transferring DataFrame to Database")
 
-    def delete_old_weather_data(self):
-        """Deletes all existing data rows in temporary table that have an
-        identical combination of (Station_ID and Datum) within the complete database table"""
-
-        temporal_table_name = "temporal_measures"
-        try:
-            delete_statement = text(f'Delete from {temporal_table_name} where "Datum" <= (Select max("Datum") from measures);')
-
-            # delete_statement = text(f"DELETE FROM {temporal_table_name} WHERE ('{temporal_table_name}.Stations_ID', '{temporal_table_name}.Datum') "
-            #          "IN (SELECT DISTINCT 'measures.Stations_ID', 'measures.Datum' FROM measures);"
-            #)
-            res = self.database.connection.execute( delete_statement )
-            self.logger.debug("Cleared duplicate data from temporary table")
-        except Exception:
-            self.logger.exception("Error clearing duplicate data from temporary table")
-
     def insert_new_weather_data(self):
-
-        Session = sessionmaker(bind=self.database.engine)
-        session = Session()
-
-        temporal_table_name = "temporal_measures"
-        temporal_table_object = self.database.metadata.tables.get(temporal_table_name)
+        """Merge all staging tables into table 'measures' by a single statement.
+        Only dates after the last existing date are inserted. Rejected rows and the archive's
+        entry in the ingest ledger are written within the same transaction."""
 
         persistent_table_object = self.database.metadata.tables.get("measures")
-        try:  # https://stackoverflow.com/questions/12941416/how-to-count-rows-with-select-count-with-sqlalchemy
+        max_date_statement = select([func.max(persistent_table_object.columns["Datum"])])
+        try:
             # GET last Date before Insert
-
-            max_persistent_table = session.query(func.max(persistent_table_object.columns["Datum"])).scalar()
-            max_temporal_table = session.query(func.max(temporal_table_object.columns["Datum"])).scalar()
-
-            latest_dates = {
-                "measure_before": max_persistent_table,
-                "temporal": max_temporal_table
-            }
+            latest_dates = {"measure_before": self.database.connection.execute(max_date_statement).scalar()}
 
             # Insert transaction
-            self.database.connection.execute(text(f'INSERT INTO "measures" SELECT * FROM {temporal_table_name};'))
+            select_statements = " UNION ALL ".join(f'SELECT * FROM "{name}"' for name in self.staging_table_names)
+            insert_statement = f'INSERT INTO "measures" SELECT * FROM ({select_statements}) AS staging'
+            parameters = {}
+            if latest_dates["measure_before"] is not None:
+                insert_statement += ' WHERE "Datum" > :latest_date'
+                parameters["latest_date"] = latest_dates["measure_before"]
+            # typed parameter, so that SQLite compares dates in its storage format
+            insert_statement = text(insert_statement).bindparams(
+                *[bindparam(name, type_=DateTime()) for name in parameters])
+            with self.database.connection.begin():
+                inserted_rows = self.database.connection.execute(insert_statement, **parameters).rowcount
+                self.sql_from_quarantine(self.database.connection)
+                self.database.record_ingestion(Path(self.saved_zipfile_path).name, self.zipfile_hash, inserted_rows)
+            self.catalog.mark(Path(self.saved_zipfile_path).name, "ingested")
 
             # GET last Date after Insert
-            latest_dates["measure_after"] = session.query(func.max(persistent_table_object.columns["Datum"])).scalar()
+            latest_dates["measure_after"] = self.database.connection.execute(max_date_statement).scalar()
 
             # SHOW newer dates
-            self.logger.info(f"Updated weather data: to new LATEST date '{latest_dates['measure_after']}' " 
+            self.logger.info(f"Updated weather data with {inserted_rows} rows: "
+                             f"to new LATEST date '{latest_dates['measure_after']}' "
                              f"from old lasted date '{latest_dates['measure_before']}'")
             # print("Updated weather data measure. \n"
             # "├ Last date before update: {before}\n"
@@ -322,3 +487,4 @@ class DataManager(object):
             #        after=latest_dates["measure_after"]))
         except Exception as ex:
             self.logger.exception(f"Error updating/integrating new weather data into permanent database table 'measure'. {ex}")
+            raise
@@ -1,10 +1,10 @@
-from bs4 import BeautifulSoup
 import requests
 from requests.models import PreparedRequest
 import requests.exceptions
 from urllib.parse import urljoin
 from pathlib import Path
 
+import app.Catalog
 import app.Helper
 
 
@@ -26,6 +26,7 @@ class DataRequester(object):
         self.last_zip_file = ""
         self.saved_zipfile_path = ""
         self.url = app.Helper.get_setting(["general","url"])
+        self.catalog = app.Catalog.SnapshotCatalog()
         # OLD self.url = url  # wetterdaten_Wettermessung.csv"
         # OLD self.url = "https://dbup2date.uni-bayreuth.de/blocklysql/"  # static link
 
@@ -45,37 +46,33 @@ class DataRequester(object):
 
     def get_distant_filename(self):
         """
-        Scrap HTML page to extract newest link.
+        Refresh the snapshot catalog from the remote HTML page and take the newest snapshot.
         """
 
         try:
             # CHECK RegEx-Url-Pattern
             self.get_checked_url()  # raises httperror
-            html_path = self.url
+            # ask for a listing sorted by name descending (Apache autoindex), i.e. newest snapshot first
+            html_path = self.url + ("?C=N;O=D" if "?" not in self.url else "")
 
-            # EXTRACT current link in html file
-            resp = requests.get(html_path, verify=False)
-            soup = BeautifulSoup(resp.content, features="html.parser")
-            if (resp.status_code == 404) or not bool(soup):
-                raise requests.HTTPError
+            # EXTRACT new links in html file, stop reading at first known link
+            with requests.get(html_path, verify=False, stream=True) as resp:
+                if resp.status_code == 404:
+                    raise requests.HTTPError
+                self.catalog.refresh(resp.iter_content(chunk_size=8192), encoding=resp.encoding or "utf-8")
 
-            self.logger.debug(f"Found website and parsed html-file")
+            self.logger.debug(f"Found website and refreshed catalog of snapshots")
 
         except (requests.HTTPError, Exception) as e:
             self.logger.error(f"Connection to {html_path} failed. URL does not exist ({e}).")
             raise
 
         # GET distant zip file path
-        zip_file_url = None
         try:
-            for link in soup.find_all('a', href=True):
-                if "wetterdaten_CSV.zip" in link['href']:
-                    zip_file_url = link['href']  # example: "downloads\wetterdaten\2019-07-07_wetterdaten_CSV.zip"
-                    break
-
-            assert "_wetterdaten_CSV.zip" in zip_file_url, "Can't find a zipfile '*wetterdaten_CSV.zip' in HTML"
-            self.last_zip_file = zip_file_url
-            self.logger.debug(f"Found a zipfile in HTML-code")
+            newest = self.catalog.get_newest()
+            assert newest is not None, "Can't find a zipfile '*wetterdaten_CSV.zip' in HTML"
+            self.last_zip_file = newest["href"]  # example: "downloads\wetterdaten\2019-07-07_wetterdaten_CSV.zip"
+            self.logger.debug(f"Found zipfile '{newest['filename']}' in catalog with status '{newest['status']}'")
 
         except Exception as ex:
             self.logger.exception(f"Error while extracting zipfile in HTML-code ({ex})")
@@ -87,6 +84,15 @@ class DataRequester(object):
         """Load last weather data from extracted link."""
         # example: url = 'https://dbup2date.uni-bayreuth.de/blocklysql/downloads/wetterdaten/2019-06-21_wetterdaten.zip'
 
+        # SKIP file that is already downloaded
+        filename = Path(self.last_zip_file.replace("\\", "/")).name
+        data_dir = app.Helper.get_setting(["general", "data_dir"])
+        self.saved_zipfile_path = Path.cwd().joinpath(data_dir).joinpath(filename)
+        newest = self.catalog.get_newest()
+        if newest["status"] != "listed" and self.saved_zipfile_path.is_file():
+            self.logger.info(f"Skipped download of {filename}, since it is already saved locally.")
+            return
+
         # REQUEST file
         try:
             # load last remote zip file
@@ -100,14 +106,11 @@ class DataRequester(object):
 
         # SAVE loaded file in filepath
         try:
-            # CREATE the "filepath" at "/data/*.zip"
-            data_dir = app.Helper.get_setting(["general", "data_dir"])
-            self.saved_zipfile_path = Path.cwd().joinpath(data_dir).joinpath(self.last_zip_file)
-
             # SAVE
             self.logger.info(f"Data-directory is set to: {data_dir}")
             Path(data_dir).mkdir(parents=True, exist_ok=True)
             open(self.saved_zipfile_path.absolute(), 'wb').write(resp.content)
+            self.catalog.mark(filename, "downloaded", size=len(resp.content), etag=resp.headers.get("ETag"))
             self.logger.info(f"Saved {self.saved_zipfile_path} from {full_url_zip}")
         except Exception:
             self.logger.exception(f"Error writing {self.saved_zipfile_path}")
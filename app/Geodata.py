@@ -0,0 +1,111 @@
+"""
+Precompiled geodata of German zip codes. The build step validates the static csv file
+'geodaten_de.csv', normalises the order of coordinates and the zip codes, and saves
+fixed-width NumPy arrays (.npy) next to it. At startup these arrays are memory-mapped,
+and they are only rebuilt when the hash of the csv file changes.
+"""
+
+import csv
+import hashlib
+from pathlib import Path
+
+import numpy as np
+
+
+ARRAY_NAMES = ["Plz", "Ort", "Latitude", "Longitude"]
+HASH_FILE_NAME = "source.sha256"
+
+# Bounding box of Germany in degree, used to validate and order coordinates.
+LATITUDE_RANGE = (47.0, 55.5)
+LONGITUDE_RANGE = (5.5, 15.5)
+
+
+def get_artifact_dir(csv_path):
+    """Directory of the artifact belonging to a csv file, e.g. 'data/geodaten_de/' for 'data/geodaten_de.csv'."""
+    csv_path = Path(csv_path)
+    return csv_path.parent.joinpath(csv_path.stem)
+
+
+def get_source_hash(csv_path):
+    return hashlib.sha256(Path(csv_path).read_bytes()).hexdigest()
+
+
+def read_geodata_csv(csv_path, encoding="cp1250"):
+    """
+    Read and validate the csv file with columns zip code, place and two coordinates.
+    The header of 'geodaten_de.csv' labels the coordinates 'Longitude;Latitude' although
+    the values are in order latitude, longitude. So the order is taken from the values.
+
+    :return: dict of NumPy arrays with keys 'ARRAY_NAMES'
+    """
+
+    with open(csv_path, encoding=encoding, newline="") as csv_file:
+        rows = list(csv.reader(csv_file, delimiter=";"))
+
+    plz, ort, first, second = [], [], [], []
+    for line_number, row in enumerate(rows[1:], start=2):
+        if len(row) != 4:
+            raise ValueError(f"{csv_path}, line {line_number}: expected 4 columns, got {len(row)}")
+        if not (row[0].isdigit() and len(row[0]) <= 5):
+            raise ValueError(f"{csv_path}, line {line_number}: invalid zip code '{row[0]}'")
+        try:
+            first.append(float(row[2]))
+            second.append(float(row[3]))
+        except ValueError:
+            raise ValueError(f"{csv_path}, line {line_number}: invalid coordinates '{row[2]};{row[3]}'")
+        plz.append(row[0].zfill(5))  # zip codes with a leading zero may have lost it
+        ort.append(row[1])
+
+    if len(set(plz)) != len(plz):
+        raise ValueError(f"{csv_path}: zip codes are not unique")
+
+    first, second = np.array(first, dtype=np.float64), np.array(second, dtype=np.float64)
+    # In Germany every latitude is larger than every longitude.
+    latitude, longitude = (first, second) if np.all(first > second) else (second, first)
+    if not (np.all((LATITUDE_RANGE[0] <= latitude) & (latitude <= LATITUDE_RANGE[1]))
+            and np.all((LONGITUDE_RANGE[0] <= longitude) & (longitude <= LONGITUDE_RANGE[1]))):
+        raise ValueError(f"{csv_path}: coordinates are outside of Germany or mixed up")
+
+    return {
+        "Plz": np.array(plz, dtype="U5"),
+        "Ort": np.array(ort, dtype=str),  # fixed width of longest place name
+        "Latitude": latitude,
+        "Longitude": longitude,
+    }
+
+
+def build_artifact(csv_path, artifact_dir=None):
+    """Validate the csv file and save its columns as .npy files in the artifact directory."""
+
+    artifact_dir = Path(artifact_dir) if artifact_dir is not None else get_artifact_dir(csv_path)
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+
+    arrays = read_geodata_csv(csv_path)
+    hash_file = artifact_dir.joinpath(HASH_FILE_NAME)
+    hash_file.unlink(missing_ok=True)  # artifact is invalid until all arrays are written
+    for name, values in arrays.items():
+        np.save(artifact_dir.joinpath(f"{name}.npy"), values)
+    hash_file.write_text(get_source_hash(csv_path))
+
+    return artifact_dir
+
+
+def artifact_is_current(csv_path, artifact_dir=None):
+    artifact_dir = Path(artifact_dir) if artifact_dir is not None else get_artifact_dir(csv_path)
+    hash_file = artifact_dir.joinpath(HASH_FILE_NAME)
+    return hash_file.is_file() and hash_file.read_text().strip() == get_source_hash(csv_path)
+
+
+def load_artifact(csv_path, artifact_dir=None):
+    """
+    Memory-map the arrays of the artifact. The artifact is (re)built if it is missing
+    or if the csv file changed since the last build.
+
+    :return: dict of read-only NumPy arrays with keys 'ARRAY_NAMES'
+    """
+
+    artifact_dir = Path(artifact_dir) if artifact_dir is not None else get_artifact_dir(csv_path)
+    if not artifact_is_current(csv_path, artifact_dir):
+        build_artifact(csv_path, artifact_dir)
+
+    return {name: np.load(artifact_dir.joinpath(f"{name}.npy"), mmap_mode="r") for name in ARRAY_NAMES}
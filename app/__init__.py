@@ -9,10 +9,12 @@ from weather data station, and appends the newest data to an existing SQL table.
 # TODO: check relevant ports
 # TODO: roll-out strategy: docker, full setup or git pull?
 
+import importlib
 
-import app.DataRequester
-import app.DataManager
-import app.Helper
 
-
-print(f"\n=======================WeatherDataManager=========================")
+def __getattr__(name):
+    # Submodules are imported on first access (e.g. 'app.DataManager'),
+    # so that 'import app' does not pay for pandas, SQLAlchemy and BeautifulSoup.
+    if name in ("DataRequester", "DataManager", "Helper", "Connector"):
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
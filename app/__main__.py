@@ -1,12 +1,154 @@
-import app.DataRequester
-import app.DataManager
-import app.Helper
+"""
+Command-line interface of the WeatherDataManager.
 
+    python -m app                 fetch newest zip file and ingest it (default)
+    python -m app fetch           download newest zip file from remote url
+    python -m app ingest [ZIP]    import newest (or given) local zip file into database
+    python -m app backfill        import all local zip files in chronological order
+    python -m app bench           time the local processing stages without database
+    python -m app bench --shards 1 2 4 8
+                                  additionally time the database load for each number of shards
+    python -m app stats           show row counts and last dates of database tables
+    python -m app geodata         rebuild the precompiled geodata of zip codes
+    python -m app export DIR      export table 'measures' with stations as partitioned Parquet or gzip CSV
 
-print(f"\n=======================WeatherDataManager=========================")
+Heavy modules (pandas, NumPy, SQLAlchemy, BeautifulSoup) are imported inside
+the subcommands that need them, so e.g. '--help' starts fast.
+"""
 
+import argparse
+import sys
 
-dr = app.DataRequester.DataRequester()
-dr.run()
-dm = app.DataManager.DataManager()
-dm.run()
\ No newline at end of file
+
+def fetch(args):
+    import app.DataRequester
+
+    app.DataRequester.DataRequester().run()
+
+
+def ingest(args):
+    import app.DataManager
+
+    app.DataManager.DataManager().run(args.zipfile)
+
+
+def backfill(args):
+    from pathlib import Path
+    import app.DataManager
+    import app.Helper
+
+    data_dir = Path.cwd().joinpath(app.Helper.get_setting(["general", "data_dir"]))
+    # The filename of all saved zipfiles starts with a date, so sorting them gives chronological order.
+    for zipfile_path in sorted(data_dir.glob('????-??-??_wetterdaten_CSV.zip')):
+        app.DataManager.DataManager().run(zipfile_path)
+
+
+def bench(args):
+    import time
+    import app.DataManager
+
+    dm = app.DataManager.DataManager(connect_database=bool(args.shards))
+    for repetition in range(args.repeat):
+        dm.stage_timings = {}
+        dm.prepare_data(args.zipfile)
+        print(f"Run {repetition + 1}: {dm.format_stage_timings()}")
+
+    # throughput of loading the staging tables, that are own tables of this benchmark.
+    # A failed load raises, since 'sql_from_weather_measures' also checks the number of loaded rows.
+    if args.shards:
+        if dm.database.connection is None:
+            raise RuntimeError("No database connection to benchmark the database load with")
+        if dm.data_weather is None or dm.data_weather.empty:
+            raise RuntimeError("No valid weather data to benchmark the database load with")
+        with dm.database.run_lock():
+            dm.start_staging()
+            try:
+                for shards in args.shards:
+                    for repetition in range(args.repeat):
+                        start = time.perf_counter()
+                        dm.sql_from_weather_measures(shards)
+                        seconds = time.perf_counter() - start
+                        print(f"Load of {len(dm.data_weather)} rows with {shards} shards, run {repetition + 1}: "
+                              f"{seconds:.3f}s, {len(dm.data_weather) / seconds:.0f} rows/s")
+            finally:
+                dm.drop_staging_tables()
+
+
+def stats(args):
+    import app.Helper
+
+    for table_name, statistics in app.Helper.MyConnector().get_table_statistics().items():
+        print(f"{table_name}: " + ", ".join(f"{key}={value}" for key, value in statistics.items()))
+
+
+def geodata(args):
+    import app.Geodata
+    import app.Helper
+
+    data_dir = app.Helper.get_setting(["general", "data_dir"])
+    print(f"Built geodata in {app.Geodata.build_artifact(data_dir + '/geodaten_de.csv')}")
+
+
+def export(args):
+    import app.DataExporter
+
+    exporter = app.DataExporter.DataExporter(args.export_dir, file_format=args.format,
+                                             partition_by=args.partition_by, batch_size=args.batch_size)
+    exporter.run(incremental=args.incremental)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="python -m app", description="WeatherDataManager")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("fetch", help="download newest zip file from remote url").set_defaults(func=fetch)
+
+    ingest_parser = subparsers.add_parser("ingest", help="import newest (or given) local zip file into database")
+    ingest_parser.add_argument("zipfile", nargs="?", default=None, help="path to zip file")
+    ingest_parser.set_defaults(func=ingest)
+
+    subparsers.add_parser("backfill", help="import all local zip files in chronological order") \
+        .set_defaults(func=backfill)
+
+    bench_parser = subparsers.add_parser("bench", help="time the local processing stages without database")
+    bench_parser.add_argument("zipfile", nargs="?", default=None, help="path to zip file")
+    bench_parser.add_argument("--repeat", type=int, default=1, help="number of repetitions")
+    bench_parser.add_argument("--shards", type=int, nargs="*", default=[],
+                              help="numbers of shards to time the parallel database load with")
+    bench_parser.set_defaults(func=bench)
+
+    subparsers.add_parser("stats", help="show row counts and last dates of database tables") \
+        .set_defaults(func=stats)
+
+    subparsers.add_parser("geodata", help="rebuild the precompiled geodata of zip codes") \
+        .set_defaults(func=geodata)
+
+    export_parser = subparsers.add_parser("export", help="export table 'measures' with stations to files")
+    export_parser.add_argument("export_dir", help="directory of exported partitions")
+    export_parser.add_argument("--format", choices=["parquet", "csv"], default="parquet",
+                               help="Parquet (requires pyarrow) or gzip CSV")
+    export_parser.add_argument("--partition-by", choices=["month", "zipcode"], default="month",
+                               help="partition by year/month or by the first two digits of the zip code")
+    export_parser.add_argument("--batch-size", type=int, default=10000, help="rows fetched per batch")
+    export_parser.add_argument("--incremental", action="store_true",
+                               help="only export partitions changed since the last export into this directory")
+    export_parser.set_defaults(func=export)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+
+    print(f"\n=======================WeatherDataManager=========================")
+    if args.command is None:
+        # without subcommand behave like the former start script: fetch and ingest
+        fetch(args)
+        args.zipfile = None
+        ingest(args)
+    else:
+        args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,5 @@
-import app
+import sys
 
-dr = app.DataRequester.DataRequester()
-dr.run()
+from app.__main__ import main
 
-
-dm = app.DataManager.DataManager()
-dm.run()
+sys.exit(main(sys.argv[1:]))
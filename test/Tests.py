@@ -1,7 +1,29 @@
+from datetime import datetime
+import pathlib
+import subprocess
+import sys
+import threading
+import time
+
+import pandas as pd
 import pytest
 import requests
+from sqlalchemy import create_engine, MetaData
+
+import app.Catalog, app.Connector, app.DataExporter, app.DataManager, app.DataRequester, app.Geodata, app.Helper
+
 
-import app.DataManager, app.DataRequester, app.Helper
+def get_sqlite_connector(path=None):
+    """MyConnector on an in-memory SQLite database, without reading settings or setting up log handlers.
+    Loading in parallel needs a database file at 'path', since every thread gets its own in-memory database."""
+
+    connector = app.Connector.MyConnector.__new__(app.Connector.MyConnector)
+    connector.logger = app.Helper.MyLogger()
+    connector.engine = create_engine(f"sqlite:///{path}" if path is not None else "sqlite://")
+    connector.connection = connector.engine.connect()
+    connector.metadata = MetaData(connector.engine)
+    connector.create_all_tables()
+    return connector
 
 def test_get_distant_filename01():
 
@@ -11,3 +33,268 @@ def test_get_distant_filename01():
 
     return
 
+
+
+def test_validate_weather_measures():
+    """Invalid rows are quarantined with their reason codes, while all other rows stay numeric and are loaded."""
+
+    columns = list(app.DataManager.MEASURE_RANGES)
+    valid_values = [f"{upper:.1f}".replace(".", ",") for lower, upper in app.DataManager.MEASURE_RANGES.values()]
+    data = pd.DataFrame([["102", "2018-07-24", "3"] + valid_values for _ in range(5)],
+                        columns=["Stations_ID", "Datum", "Qualitaet"] + columns)
+    data["Datum"] = pd.to_datetime(["2018-07-24", "2018-07-24", "2018-07-25", "2018-07-26", "2018-07-27"])
+    data.loc[1, "Min_2m"] = "7,0"  # duplicate key
+    data.loc[2, "Max_2m"] = "abc"
+    data.loc[3, "Relative_Feuchte"] = "112,5"
+    data.loc[4, "Qualitaet"] = "4"
+    data = pd.concat([data, data.iloc[[0]].assign(Datum=pd.Timestamp("2018-07-28"))], ignore_index=True)
+
+    dm = app.DataManager.DataManager(connect_database=False)
+    dm.data_weather = data
+    dm.validate_weather_measures()
+
+    assert list(dm.data_quarantine["Reason"]) \
+        == ["duplicate_key", "non_numeric", "range_Relative_Feuchte", "unknown_quality"]
+    assert list(dm.data_weather["Datum"].dt.day) == [24, 28]
+    assert list(dm.data_weather["Relative_Feuchte"]) == [100.0, 100.0]
+    assert dm.data_weather["Stations_ID"].dtype == "int64"
+
+    return
+
+
+def test_validate_duplicate_keys():
+    """Of rows with the same key, the first valid row is loaded, even if an invalid row comes first."""
+
+    columns = list(app.DataManager.MEASURE_RANGES)
+    valid_values = [f"{upper:.1f}".replace(".", ",") for lower, upper in app.DataManager.MEASURE_RANGES.values()]
+    data = pd.DataFrame([["102", "2018-07-24", "3"] + valid_values for _ in range(3)],
+                        columns=["Stations_ID", "Datum", "Qualitaet"] + columns)
+    data["Datum"] = pd.to_datetime(data["Datum"])
+    data.loc[0, "Relative_Feuchte"] = "112,5"
+    data.loc[1, "Min_2m"] = "7,0"
+    data.loc[2, "Min_2m"] = "8,0"
+
+    dm = app.DataManager.DataManager(connect_database=False)
+    dm.data_weather = data
+    dm.validate_weather_measures()
+
+    assert list(dm.data_quarantine["Reason"]) == ["range_Relative_Feuchte", "duplicate_key"]
+    assert list(dm.data_weather["Min_2m"]) == [7.0]
+
+    return
+
+
+def test_import_time_of_cli():
+    """Starting the command-line interface must not import heavy modules and stay within its time budget."""
+
+    project_path = pathlib.Path(__file__).absolute().parent.parent
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.__main__"],
+                            cwd=project_path, capture_output=True, text=True, check=True)
+
+    # lines look like: "import time:       self [us] |  cumulative | imported package"
+    imported = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "[us]" not in line:
+            _, cumulative, package = line.split("|")
+            imported[package.strip()] = int(cumulative)
+
+    heavy_modules = {"pandas", "numpy", "sqlalchemy", "bs4", "requests"}
+    assert heavy_modules.isdisjoint(imported), f"Heavy modules imported at startup: {heavy_modules & set(imported)}"
+    assert imported["app.__main__"] < 100000, "Importing the command-line interface takes longer than 100 ms"
+
+    return
+
+
+def test_snapshot_catalog(tmp_path):
+    """Refreshing the catalog from a saved listing finds the newest snapshot and stops at known snapshots."""
+
+    listing = pathlib.Path(__file__).absolute().parent.joinpath("fixtures", "wetterdaten_index.html").read_bytes()
+    chunks = [listing[i:i + 256] for i in range(0, len(listing), 256)]
+    yesterdays_listing = [listing.replace(b'href="2020-01-26_wetterdaten_CSV.zip"', b'href="#"')]
+
+    catalog = app.Catalog.SnapshotCatalog(tmp_path.joinpath("catalog.sqlite"))
+    assert catalog.refresh(yesterdays_listing) == 5
+    assert catalog.get_newest()["filename"] == "2019-10-31_wetterdaten_CSV.zip"
+    assert catalog.refresh(chunks) == 1  # only the newest snapshot is new
+    assert catalog.refresh(chunks) == 0
+
+    newest = catalog.get_newest()
+    assert newest["filename"] == "2020-01-26_wetterdaten_CSV.zip"
+    assert newest["status"] == "listed"
+    assert newest["size"] == 835 * 1024  # from listing
+
+    catalog.mark(newest["filename"], "downloaded", size=855040, etag='"d0c00-59d05"')
+    assert catalog.get_newest()["status"] == "downloaded"
+    catalog.close()
+
+    return
+
+
+def test_snapshot_catalog_ascending(tmp_path):
+    """A listing ordered from oldest to newest snapshot is read completely, so new snapshots at its end are found."""
+
+    listing = pathlib.Path(__file__).absolute().parent.joinpath("fixtures", "wetterdaten_index_ascending.html") \
+        .read_bytes()
+    chunks = [listing[i:i + 256] for i in range(0, len(listing), 256)]
+    yesterdays_listing = [listing.replace(b'href="2020-01-26_wetterdaten_CSV.zip"', b'href="#"')]
+
+    catalog = app.Catalog.SnapshotCatalog(tmp_path.joinpath("catalog.sqlite"))
+    assert catalog.refresh(yesterdays_listing) == 5
+    assert catalog.refresh(chunks) == 1
+    assert catalog.get_newest()["filename"] == "2020-01-26_wetterdaten_CSV.zip"
+    assert catalog.get_newest()["size"] == 835 * 1024
+    catalog.close()
+
+    return
+
+
+def test_geodata_artifact(tmp_path):
+    """The artifact holds latitude and longitude in correct order, 5-digit zip codes, and follows the csv file."""
+
+    csv_path = tmp_path.joinpath("geodaten_de.csv")
+    csv_path.write_text('Plz;Ort;Longitude;Latitude\n1067;"Dresden";51.06;13.7211\n'
+                        '95444;"Bayreuth";49.9427;11.5783\n', encoding="cp1250")
+
+    arrays = app.Geodata.load_artifact(csv_path)
+    assert list(arrays["Plz"]) == ["01067", "95444"]
+    assert list(arrays["Latitude"]) == [51.06, 49.9427]
+    assert list(arrays["Longitude"]) == [13.7211, 11.5783]
+    assert app.Geodata.artifact_is_current(csv_path)
+
+    csv_path.write_text('Plz;Ort;Latitude;Longitude\n01067;"Dresden";51.06;13.7211\n', encoding="cp1250")
+    assert not app.Geodata.artifact_is_current(csv_path)
+    assert list(app.Geodata.load_artifact(csv_path)["Plz"]) == ["01067"]
+
+    return
+
+
+def test_ingest_ledger():
+    """An archive counts as ingested only with identical name and content hash."""
+
+    connector = get_sqlite_connector()
+    assert not connector.is_ingested("2019-10-07_wetterdaten_CSV.zip", "d0c2f1")
+
+    connector.record_ingestion("2019-10-07_wetterdaten_CSV.zip", "d0c2f1", 41113)
+    assert connector.is_ingested("2019-10-07_wetterdaten_CSV.zip", "d0c2f1")
+    assert not connector.is_ingested("2019-10-07_wetterdaten_CSV.zip", "e7a9b0")  # changed content
+
+    return
+
+
+def test_run_lock():
+    """A second run waits until the first run releases the lock (file lock of embedded databases)."""
+
+    connector = get_sqlite_connector()
+    entered = []
+
+    def second_run():
+        with connector.run_lock():
+            entered.append(time.perf_counter())
+
+    with connector.run_lock():
+        thread = threading.Thread(target=second_run)
+        thread.start()
+        time.sleep(0.2)
+        assert not entered
+        released = time.perf_counter()
+    thread.join(timeout=5)
+
+    assert entered and entered[0] >= released
+
+    return
+
+
+
+@pytest.mark.parametrize("shards", [1, 3])
+def test_load_weather_measures(tmp_path, shards):
+    """Sharded staging tables are merged into table 'measures', and a later archive only adds newer dates."""
+
+    connector = get_sqlite_connector(tmp_path.joinpath("weather.sqlite"))  # shards load over their own connections
+    dm = app.DataManager.DataManager(connect_database=False)
+    dm.database = connector
+    dm.catalog = app.Catalog.SnapshotCatalog(tmp_path.joinpath("catalog.sqlite"))
+
+    def load(archive, days, temperature):
+        dm.saved_zipfile_path, dm.zipfile_hash = archive, archive
+        dm.data_weather = pd.DataFrame([{"Stations_ID": station_id, "Datum": datetime(2019, 10, day),
+                                         "Qualitaet": 3, "Mittel_2m": temperature}
+                                        for station_id in range(1, 8) for day in days])
+        dm.start_staging()
+        try:
+            dm.sql_from_weather_measures(shards)
+            assert len(dm.staging_table_names) == shards
+            dm.insert_new_weather_data()
+        finally:
+            dm.drop_staging_tables()
+
+    def read_measures():
+        return pd.read_sql('SELECT "Stations_ID", "Datum", "Mittel_2m" FROM measures '
+                           'ORDER BY "Datum", "Stations_ID"', connector.connection, parse_dates=["Datum"])
+
+    load("2019-10-22_wetterdaten_CSV.zip", [20, 21, 22], 10.5)
+    measures = read_measures()
+    assert len(measures) == 7 * 3
+    assert list(measures["Stations_ID"][:7]) == list(range(1, 8))
+    assert set(measures["Mittel_2m"]) == {10.5}
+
+    load("2019-10-24_wetterdaten_CSV.zip", [21, 22, 23, 24], 12.5)  # older dates are already loaded
+    measures = read_measures()
+    assert len(measures) == 7 * 5
+    assert set(measures[measures["Datum"] <= datetime(2019, 10, 22)]["Mittel_2m"]) == {10.5}
+    assert set(measures[measures["Datum"] > datetime(2019, 10, 22)]["Mittel_2m"]) == {12.5}
+
+    ledger = connector.connection.execute('SELECT "Archive", "Rows" FROM ingest_ledger ORDER BY "Archive"').fetchall()
+    assert [tuple(row) for row in ledger] \
+        == [("2019-10-22_wetterdaten_CSV.zip", 21), ("2019-10-24_wetterdaten_CSV.zip", 14)]
+    assert not [name for name in connector.engine.table_names() if name.startswith(dm.temporal_table_name)]
+
+    return
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet"])
+@pytest.mark.parametrize("partition_by", ["month", "zipcode"])
+def test_data_exporter(tmp_path, file_format, partition_by):
+    """All rows are exported once into their partition, and an incremental export only rewrites changed partitions."""
+
+    if file_format == "parquet":
+        pytest.importorskip("pyarrow")
+
+    connector = get_sqlite_connector()
+    station = {"Standort": "Bayreuth", "Geo_Breite": 49.9, "Geo_Laenge": 11.6, "Hoehe": 360, "Betreiber": "DWD",
+               "Ort_matched": "Bayreuth", "Latitude_matched": 49.9, "Longitude_matched": 11.6}
+    connector.connection.execute(connector.metadata.tables["stations"].insert(), [
+        dict(station, S_ID=1, PLZ_matched="95444"), dict(station, S_ID=2, PLZ_matched="01067")])
+    measures = connector.metadata.tables["measures"]
+    rows = [{"Stations_ID": station_id, "Datum": datetime(2019, month, day), "Mittel_2m": 1.5}
+            for station_id in [1, 2, 3] for month in [8, 9] for day in [1, 2]]  # station 3 has no zip code
+    connector.connection.execute(measures.insert(), rows)
+
+    # a small batch size switches partitions within and between batches
+    exporter = app.DataExporter.DataExporter(tmp_path, file_format, partition_by, batch_size=5, database=connector)
+    exporter.run()
+
+    def read_export():
+        files = sorted(tmp_path.glob("*/**/part.*"))
+        if file_format == "parquet":
+            return files, {str(path.parent.relative_to(tmp_path)): pd.read_parquet(path) for path in files}
+        return files, {str(path.parent.relative_to(tmp_path)): pd.read_csv(path, sep=";", decimal=",")
+                       for path in files}
+
+    files, partitions = read_export()
+    expected = {"month": ["year=2019/month=08", "year=2019/month=09"],
+                "zipcode": ["zip_prefix=01", "zip_prefix=95", "zip_prefix=unknown"]}[partition_by]
+    assert sorted(partitions) == expected
+    assert sum(len(data) for data in partitions.values()) == len(rows)
+    assert not list(tmp_path.glob("**/*.tmp"))
+
+    inodes = {path: path.stat().st_ino for path in files}  # a rewritten file replaces the old one
+    connector.connection.execute(measures.insert(), {"Stations_ID": 1, "Datum": datetime(2019, 9, 3)})
+    exporter.run(incremental=True)
+
+    files, partitions = read_export()
+    changed = {"month": "year=2019/month=09", "zipcode": "zip_prefix=95"}[partition_by]
+    assert [path for path in files if path.stat().st_ino != inodes[path]] \
+        == [tmp_path.joinpath(changed, files[0].name)]
+    assert len(partitions[changed]) == len(rows) // len(expected) + 1
+
+    return